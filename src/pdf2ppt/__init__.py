@@ -250,7 +250,8 @@ def main():
             watermark_tmp = args.input.parent / TMP_DIR_NAME / f'{args.input.stem}_nowm.pdf'
             watermark_tmp.parent.mkdir(parents=True, exist_ok=True)
             try:
-                wm_result = remove_watermark(str(args.input), str(watermark_tmp))
+                wm_result = remove_watermark(str(args.input), str(watermark_tmp),
+                                             workers=args.parallel)
                 console.print(f"[green]\u2705 Watermark removed from {wm_result['pages_processed']} pages[/green]")
                 actual_input = watermark_tmp
                 pdf_reader = PdfReader(actual_input)
@@ -1,56 +1,291 @@
 """Watermark removal for NotebookLM exported PDFs.
 
-Uses PyMuPDF to detect and cover the bottom-right watermark with
-column-by-column sampled background colors (supports gradients).
+Uses PyMuPDF to redact the bottom-right watermark and cover it with
+column-by-column sampled background colours (supports gradients).
+
+Background sampling is independent per page, so larger documents can
+opt in to sampling in a process pool (one ``fitz.open`` per worker, as PyMuPDF
+documents cannot be shared across processes) and the resulting cover
+rects are drawn serially into the output document as each shard
+finishes. Threads are deliberately not used: PyMuPDF is not thread-safe
+and holds the GIL while rendering. Pools always use the ``spawn`` start
+method, since callers such as the web and MCP servers are multi-threaded
+and forking them can deadlock.
+
+Several files can be processed at once with ``remove_watermark_batch``,
+which follows PyMuPDF's multiprocessing recipe: each file is handled by
+one worker process that opens its own document, so files never share
+PyMuPDF state.
 """
 
-import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Optional
 
 import fitz
-from PIL import Image
+import numpy as np
+
+MAX_WORKERS = 4
+# Shards per worker, so drawing can start while later shards are sampled
+SHARDS_PER_WORKER = 4
+# Below this many pages, (spawned) process start-up costs more than it saves
+PARALLEL_MIN_PAGES = 8
+# 1x zoom is enough for the sample strip: only one row of column colours is read
+SAMPLE_MATRIX = fitz.Identity
+# uint8 channel value -> PDF colour component in [0, 1]
+U8_TO_UNIT = (np.arange(256) / 255.0).astype(np.float32)
+# Max per-channel spread (uint8) for a sampled row to count as one flat colour
+FLAT_TOLERANCE = 2
+# From this many colour runs on, cover with one 1px-tall gradient image
+# instead of one rect per run
+GRADIENT_IMAGE_MIN_RUNS = 16
+
+
+def _default_workers() -> int:
+    """CPUs usable by this process (affinity/cgroup aware), capped at MAX_WORKERS."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    return min(cpus, MAX_WORKERS)
+
+
+def _colour_runs(row: np.ndarray) -> np.ndarray:
+    """Split a W×3 uint8 colour row into runs of identical colour.
+
+    Colours are compared after quantising to 6 bits per channel, so flat
+    stretches are painted with one rect instead of one per column. A row
+    whose channels all vary by at most ``FLAT_TOLERANCE`` is a single run,
+    even if it straddles a quantisation boundary.
+
+    Returns:
+        Run boundaries ``[0, b1, ..., W]``; run *k* spans ``breaks[k]:breaks[k + 1]``.
+    """
+    if int((row.max(axis=0).astype(np.int16) - row.min(axis=0)).max()) <= FLAT_TOLERANCE:
+        return np.array([0, len(row)])
+    row_q = row >> 2
+    return np.r_[0, np.flatnonzero(np.any(np.diff(row_q, axis=0), axis=1)) + 1, len(row_q)]
+
+
+def _cover_ops(page: "fitz.Page", cache: Optional[dict] = None) -> Optional[tuple]:
+    """Sample the background above the watermark and plan the cover rects.
+
+    Args:
+        page: Page to sample.
+        cache: Optional dict reused across pages; slide decks usually repeat
+            the same background, so identical sampled rows on same-sized
+            pages replay the previously planned rects.
+
+    Returns:
+        ``(wm_rect, ops)``, where ``wm_rect`` is the ``(x0, y0, x1, y1)``
+        watermark region to redact and ``ops`` is a list of
+        ``((x0, y0, x1, y1), fill)`` tuples. ``fill`` is an ``(r, g, b)``
+        tuple for a solid rect (one per colour run) or, on gradient pages,
+        the raw RGB bytes of a 1px-tall image stretched over the rect.
+        ``None`` if nothing is drawn in the watermark region.
+    """
+    rect = page.rect
+    w, h = rect.width, rect.height
+
+    # Watermark region – fixed bottom-right position used by NotebookLM
+    wm_x1 = w - 115
+    wm_y1 = h - 30
+    wm_x2 = w - 5
+    wm_y2 = h - 5
+
+    # Skip pages with no text, image or vector content under the watermark
+    wm_rect = fitz.Rect(wm_x1, wm_y1, wm_x2, wm_y2)
+    if not any(wm_rect.intersects(bbox) for _, bbox in page.get_bboxlog()):
+        return None
+
+    # Sample a 1pt-tall row just above the watermark for background colours
+    sample_rect = fitz.Rect(wm_x1, wm_y1 - 6, wm_x2, wm_y1 - 5)
+    pix = page.get_pixmap(matrix=SAMPLE_MATRIX, clip=sample_rect)
+    # Read the raw sample buffer directly (no PNG encode/decode round-trip)
+    buf = np.frombuffer(pix.samples, dtype=np.uint8).reshape(
+        pix.height, pix.stride // pix.n, pix.n)[:, :pix.width, :3]
+    # Average whatever rows the clip yields (one at 1x zoom on whole-point
+    # page sizes, two if the row straddles a pixel boundary)
+    row = np.rint(buf.mean(axis=0)).astype(np.uint8)
+
+    if cache is not None:
+        key = (w, h, row.tobytes())
+        plan = cache.get(key)
+        if plan is not None:
+            return plan
+
+    breaks = _colour_runs(row)
 
+    if len(breaks) - 1 >= GRADIENT_IMAGE_MIN_RUNS:
+        # Grown by half a point to match the stroke overhang of the rects
+        ops = [((wm_x1 - 0.5, wm_y1 - 0.5, wm_x2 + 0.5, wm_y2 + 0.5), row.tobytes())]
+    else:
+        # One rect per run to preserve gradient backgrounds
+        col_width = (wm_x2 - wm_x1) / pix.width
+        xs = (wm_x1 + np.arange(pix.width + 1) * col_width).tolist()
+        run_rgb = (np.add.reduceat(U8_TO_UNIT[row], breaks[:-1], axis=0)
+                   / np.diff(breaks)[:, None]).tolist()
+        ops = [((xs[start], wm_y1, xs[end], wm_y2), tuple(rgb))
+               for start, end, rgb in zip(breaks[:-1].tolist(), breaks[1:].tolist(), run_rgb)]
 
-def remove_watermark(input_path: str, output_path: str) -> dict:
+    plan = ((wm_x1, wm_y1, wm_x2, wm_y2), ops)
+    if cache is not None:
+        cache[key] = plan
+    return plan
+
+
+def _sample_pages(input_path: str, indices: list) -> list:
+    """Worker entry point: plan cover rects for a shard of page indices."""
+    doc = fitz.open(input_path)
+    try:
+        cache = {}
+        return [(i, _cover_ops(doc[i], cache)) for i in indices]
+    finally:
+        doc.close()
+
+
+def _draw_ops(doc: "fitz.Document", page_ops) -> int:
+    """Redact the watermark and draw planned cover ops.
+
+    Returns:
+        Number of pages touched.
+    """
+    pages_drawn = 0
+    for i, plan in page_ops:
+        if not plan:
+            continue
+        wm_rect, ops = plan
+        page = doc[i]
+        # Excise the watermark itself rather than only painting over it.
+        # Images are kept (NotebookLM often bakes the page into one raster)
+        # and line art is dropped only if it lies entirely in the region,
+        # so full-page backgrounds survive. Must run before the covers are
+        # drawn, or they would be redacted too. The exact watermark rect is
+        # redacted, not the (possibly slightly grown) cover.
+        page.add_redact_annot(fitz.Rect(wm_rect), fill=False)
+        page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE,
+                              graphics=fitz.PDF_REDACT_LINE_ART_REMOVE_IF_COVERED)
+        # Group runs by colour so each colour is set once in the content stream
+        by_colour = {}
+        for rect, fill in ops:
+            if isinstance(fill, bytes):
+                pm = fitz.Pixmap(fitz.csRGB, len(fill) // 3, 1, fill, False)
+                page.insert_image(fitz.Rect(rect), pixmap=pm, keep_proportion=False)
+            else:
+                by_colour.setdefault(fill, []).append(rect)
+        if not by_colour:
+            pages_drawn += 1
+            continue
+        shape = page.new_shape()
+        for rgb, rects in by_colour.items():
+            for rect in rects:
+                shape.draw_rect(fitz.Rect(rect))
+            shape.finish(color=rgb, fill=rgb)
+        shape.commit()
+        pages_drawn += 1
+    return pages_drawn
+
+
+def remove_watermark(input_path: str, output_path: str,
+                     workers: Optional[int] = 1) -> dict:
     """Remove NotebookLM watermark from every page of a PDF.
 
     Args:
         input_path: Source PDF file path.
-        output_path: Destination PDF file path.
+        output_path: Destination PDF file path. May equal ``input_path``
+            to update the file in place.
+        workers: Sampling processes to use, at most ``MAX_WORKERS``
+            (default: 1, in-process; ``None`` for usable CPUs).
+            Documents shorter than ``PARALLEL_MIN_PAGES`` are always
+            processed in-process.
+
+    Content under the watermark region is redacted, not just covered.
+    Redaction removes every character whose box touches the region, so a
+    line of footer text running into it loses those characters even where
+    they extend past the cover.
 
     Returns:
-        dict with ``pages_processed`` count.
+        dict with ``pages_processed`` count (pages with nothing drawn in
+        the watermark region are left untouched and not counted).
     """
     doc = fitz.open(input_path)
+    page_count = doc.page_count
+    # Explicit counts are capped too: sampling costs milliseconds per page,
+    # so extra spawned interpreters only add start-up time
+    workers = _default_workers() if workers is None else min(workers, MAX_WORKERS)
+
     pages_processed = 0
+    if workers > 1 and page_count >= PARALLEL_MIN_PAGES:
+        # Contiguous shards; draw each one as soon as its worker returns
+        shard_size = -(-page_count // (workers * SHARDS_PER_WORKER))
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_sample_pages, input_path,
+                                       list(range(i, min(i + shard_size, page_count))))
+                       for i in range(0, page_count, shard_size)]
+            for future in as_completed(futures):
+                pages_processed += _draw_ops(doc, future.result())
+    else:
+        cache = {}
+        pages_processed = _draw_ops(doc, ((i, _cover_ops(doc[i], cache))
+                                          for i in range(page_count)))
+
+    in_place = Path(input_path).resolve() == Path(output_path).resolve()
+    if not pages_processed:
+        # Nothing was redacted or drawn: leave in-place input alone,
+        # otherwise copy the source bytes verbatim
+        doc.close()
+        if not in_place:
+            shutil.copyfile(input_path, output_path)
+        return {"pages_processed": 0}
 
-    for page in doc:
-        rect = page.rect
-
-        # Watermark region \u2013 fixed bottom-right position used by NotebookLM
-        wm_x1 = rect.width - 115
-        wm_y1 = rect.height - 30
-        wm_x2 = rect.width - 5
-        wm_y2 = rect.height - 5
-
-        # Sample a thin strip just above the watermark for background colours
-        sample_rect = fitz.Rect(wm_x1, wm_y1 - 10, wm_x2, wm_y1 - 2)
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), clip=sample_rect)
-        img = Image.open(io.BytesIO(pix.tobytes("png")))
-        pixels = img.load()
-
-        # Draw column-by-column to preserve gradient backgrounds
-        col_width = (wm_x2 - wm_x1) / img.width
-        for x in range(img.width):
-            r, g, b = (c / 255 for c in pixels[x, img.height // 2][:3])
-            col_rect = fitz.Rect(
-                wm_x1 + x * col_width, wm_y1,
-                wm_x1 + (x + 1) * col_width, wm_y2,
-            )
-            page.draw_rect(col_rect, color=(r, g, b), fill=(r, g, b))
-
-        pages_processed += 1
-
-    doc.save(output_path)
-    doc.close()
+    # Redaction rewrites page contents, which rules out incremental saves,
+    # so in-place output goes through a temp file in the same directory
+    save_path = output_path
+    if in_place:
+        fd, save_path = tempfile.mkstemp(suffix=".pdf", dir=Path(output_path).resolve().parent)
+        os.close(fd)
+    try:
+        # Drop the content streams orphaned by redaction. No deflate: it
+        # compresses every unfiltered stream, images included, which can make
+        # saving image-heavy exports hundreds of times slower.
+        doc.save(save_path, garbage=1)
+        doc.close()
+        if in_place:
+            os.replace(save_path, output_path)
+    finally:
+        if not doc.is_closed:
+            doc.close()
+        if in_place and os.path.exists(save_path):
+            os.unlink(save_path)
     return {"pages_processed": pages_processed}
+
+
+def _remove_watermark_pair(pair: tuple) -> dict:
+    """Batch worker: process one file in-process (no nested pool)."""
+    input_path, output_path = pair
+    return remove_watermark(input_path, output_path, workers=1)
+
+
+def remove_watermark_batch(pairs: list, workers: Optional[int] = None) -> list:
+    """Remove NotebookLM watermarks from several PDFs in parallel.
+
+    Args:
+        pairs: ``(input_path, output_path)`` tuples.
+        workers: Worker processes (default: usable CPUs, at most ``MAX_WORKERS``).
+
+    Returns:
+        list of ``remove_watermark`` result dicts, in the order of ``pairs``.
+    """
+    pairs = list(pairs)
+    if workers is None:
+        workers = _default_workers()
+    if workers <= 1 or len(pairs) <= 1:
+        return [_remove_watermark_pair(pair) for pair in pairs]
+    with ProcessPoolExecutor(max_workers=min(workers, len(pairs)),
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        return list(executor.map(_remove_watermark_pair, pairs))
@@ -20,28 +20,52 @@ from unittest.mock import patch, MagicMock
 
 import pytest
 import fitz
+import numpy as np
 from PIL import Image
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
 
 from pdf2ppt import parse_page_range, check_dependency, __version__
-from pdf2ppt.watermark import remove_watermark
+from pdf2ppt.watermark import remove_watermark, remove_watermark_batch, _colour_runs, _cover_ops
 
 
 # ── Helpers ──────────────────────────────────────────────────────────
 
+def add_test_page(doc, number: int = 1, width: float = 612, height: float = 792):
+    """Append a coloured page with a simulated watermark to an open document."""
+    page = doc.new_page(width=width, height=height)
+    # Draw a background colour
+    page.draw_rect(page.rect, color=(0.2, 0.3, 0.8), fill=(0.9, 0.9, 0.95))
+    # Simulate a NotebookLM watermark in bottom-right
+    wm_rect = fitz.Rect(width - 115, height - 30, width - 5, height - 5)
+    page.draw_rect(wm_rect, color=(0.5, 0.5, 0.5), fill=(0.5, 0.5, 0.5))
+    page.insert_text((50, 100), f"Test Page {number}", fontsize=24)
+
+
 def create_test_pdf(path: str, pages: int = 3, width: float = 612, height: float = 792):
     """Create a minimal test PDF with coloured pages."""
     doc = fitz.open()
     for i in range(pages):
-        page = doc.new_page(width=width, height=height)
-        # Draw a background colour
-        page.draw_rect(page.rect, color=(0.2, 0.3, 0.8), fill=(0.9, 0.9, 0.95))
-        # Simulate a NotebookLM watermark in bottom-right
-        wm_rect = fitz.Rect(width - 115, height - 30, width - 5, height - 5)
-        page.draw_rect(wm_rect, color=(0.5, 0.5, 0.5), fill=(0.5, 0.5, 0.5))
-        page.insert_text((50, 100), f"Test Page {i + 1}", fontsize=24)
+        add_test_page(doc, i + 1, width, height)
+    doc.save(path)
+    doc.close()
+
+
+def create_gradient_pdf(path: str, ramp, flat_pages: int = 0):
+    """Create a Letter page with a horizontal grey gradient and a red watermark.
+
+    ``ramp`` maps an x position (0-611) to a grey level in [0, 1]. Plain
+    ``add_test_page`` pages are appended after it if ``flat_pages`` is set.
+    """
+    doc = fitz.open()
+    page = doc.new_page(width=612, height=792)
+    for x in range(612):
+        c = ramp(x)
+        page.draw_rect(fitz.Rect(x, 0, x + 1, 792), color=None, fill=(c, c, c), width=0)
+    page.draw_rect(fitz.Rect(497, 762, 607, 787), color=None, fill=(1, 0, 0), width=0)
+    for i in range(flat_pages):
+        add_test_page(doc, i + 2)
     doc.save(path)
     doc.close()
 
@@ -162,6 +186,240 @@ class TestWatermarkRemoval:
         # Pixels should be different (watermark was covered)
         assert before_bytes != after_bytes
 
+    def test_watermark_region_matches_background(self, tmp_path):
+        """The covered region should take the sampled background colour."""
+        input_pdf = str(tmp_path / 'bg.pdf')
+        output_pdf = str(tmp_path / 'bg_out.pdf')
+        create_test_pdf(input_pdf, pages=1)
+
+        remove_watermark(input_pdf, output_pdf)
+
+        doc = fitz.open(output_pdf)
+        page = doc[0]
+        rect = page.rect
+        wm_rect = fitz.Rect(rect.width - 115, rect.height - 30, rect.width - 5, rect.height - 5)
+        pix = page.get_pixmap(clip=wm_rect)
+        r, g, b = pix.pixel(pix.width // 2, pix.height // 2)
+        doc.close()
+
+        # Background fill in create_test_pdf is (0.9, 0.9, 0.95)
+        assert abs(r - 229) <= 2
+        assert abs(g - 229) <= 2
+        assert abs(b - 242) <= 2
+
+    def test_flat_background_single_rect(self, tmp_path):
+        """A uniform background should be covered by one rect, not one per column."""
+        input_pdf = str(tmp_path / 'flat.pdf')
+        output_pdf = str(tmp_path / 'flat_out.pdf')
+        create_test_pdf(input_pdf, pages=1)
+
+        doc = fitz.open(input_pdf)
+        drawings_before = len(doc[0].get_drawings())
+        doc.close()
+
+        remove_watermark(input_pdf, output_pdf)
+
+        doc = fitz.open(output_pdf)
+        assert len(doc[0].get_drawings()) == drawings_before + 1
+        doc.close()
+
+    def test_gradient_background_preserved(self, tmp_path):
+        """Horizontal gradients should still be reproduced column by column."""
+        input_pdf = str(tmp_path / 'gradient.pdf')
+        output_pdf = str(tmp_path / 'gradient_out.pdf')
+        create_gradient_pdf(input_pdf, lambda x: x / 611)
+
+        remove_watermark(input_pdf, output_pdf)
+
+        doc = fitz.open(output_pdf)
+        wm_rect = fitz.Rect(497, 762, 607, 787)
+        pix = doc[0].get_pixmap(clip=wm_rect)
+        left = pix.pixel(2, pix.height // 2)
+        right = pix.pixel(pix.width - 3, pix.height // 2)
+        doc.close()
+
+        # Red watermark gone and the left edge darker than the right edge
+        assert abs(left[0] - left[1]) <= 2
+        assert right[0] - left[0] > 20
+
+    def test_gradient_covered_by_single_image(self, tmp_path):
+        """Gradients get one stretched image; flat backgrounds get none."""
+        input_pdf = str(tmp_path / 'gradient_img.pdf')
+        output_pdf = str(tmp_path / 'gradient_img_out.pdf')
+        # Steep ramp across the watermark columns
+        create_gradient_pdf(input_pdf, lambda x: min(max((x - 497) / 110, 0), 1), flat_pages=1)
+
+        remove_watermark(input_pdf, output_pdf)
+
+        doc = fitz.open(output_pdf)
+        assert len(doc[0].get_images()) == 1
+        assert len(doc[1].get_images()) == 0
+        doc.close()
+
+    def test_redact_rect_is_watermark_region(self, tmp_path):
+        """Gradient pages redact the watermark region, not the grown image rect."""
+        input_pdf = str(tmp_path / 'gradient_redact.pdf')
+        create_gradient_pdf(input_pdf, lambda x: min(max((x - 497) / 110, 0), 1), flat_pages=1)
+
+        doc = fitz.open(input_pdf)
+        plans = [_cover_ops(page) for page in doc]
+        doc.close()
+
+        for wm_rect, _ in plans:
+            assert wm_rect == (497, 762, 607, 787)
+        # The gradient image itself still overhangs by half a point
+        assert plans[0][1][0][0] == (496.5, 761.5, 607.5, 787.5)
+
+    def test_parallel_matches_sequential(self, tmp_path):
+        """Process-pool sampling should produce the same pages as in-process."""
+        input_pdf = str(tmp_path / 'par.pdf')
+        seq_pdf = str(tmp_path / 'par_seq.pdf')
+        par_pdf = str(tmp_path / 'par_par.pdf')
+        create_test_pdf(input_pdf, pages=10)
+
+        assert remove_watermark(input_pdf, seq_pdf, workers=1)['pages_processed'] == 10
+        assert remove_watermark(input_pdf, par_pdf, workers=2)['pages_processed'] == 10
+
+        doc_seq = fitz.open(seq_pdf)
+        doc_par = fitz.open(par_pdf)
+        for page_seq, page_par in zip(doc_seq, doc_par):
+            assert page_seq.get_pixmap().samples == page_par.get_pixmap().samples
+        doc_seq.close()
+        doc_par.close()
+
+    def test_page_without_watermark_skipped(self, tmp_path):
+        """Pages with nothing in the watermark region should be left alone."""
+        input_pdf = str(tmp_path / 'blank.pdf')
+        output_pdf = str(tmp_path / 'blank_out.pdf')
+        doc = fitz.open()
+        doc.new_page(width=612, height=792).insert_text((50, 100), "No watermark", fontsize=24)
+        add_test_page(doc, 2)
+        doc.save(input_pdf)
+        doc.close()
+
+        result = remove_watermark(input_pdf, output_pdf)
+        assert result['pages_processed'] == 1
+
+        doc = fitz.open(output_pdf)
+        assert len(doc) == 2
+        assert doc[0].get_drawings() == []
+        doc.close()
+
+    def test_in_place_removal(self, tmp_path):
+        """Writing back to the input path should update the file in place."""
+        pdf = str(tmp_path / 'inplace.pdf')
+        create_test_pdf(pdf, pages=2)
+
+        result = remove_watermark(pdf, pdf)
+        assert result['pages_processed'] == 2
+
+        assert os.listdir(tmp_path) == ['inplace.pdf']
+        doc = fitz.open(pdf)
+        assert len(doc) == 2
+        page = doc[0]
+        rect = page.rect
+        wm_rect = fitz.Rect(rect.width - 115, rect.height - 30, rect.width - 5, rect.height - 5)
+        pix = page.get_pixmap(clip=wm_rect)
+        r, g, b = pix.pixel(pix.width // 2, pix.height // 2)
+        doc.close()
+
+        # Grey watermark replaced by the (0.9, 0.9, 0.95) background
+        assert abs(r - 229) <= 2
+        assert abs(g - 229) <= 2
+        assert abs(b - 242) <= 2
+
+    def test_in_place_save_failure_cleans_up(self, tmp_path):
+        """A failed in-place save leaves the original file and no temp file."""
+        pdf = str(tmp_path / 'inplace_fail.pdf')
+        create_test_pdf(pdf, pages=1)
+        with open(pdf, 'rb') as f:
+            original = f.read()
+
+        with patch.object(fitz.Document, 'save', side_effect=RuntimeError('disk full')):
+            with pytest.raises(RuntimeError):
+                remove_watermark(pdf, pdf)
+
+        assert os.listdir(tmp_path) == ['inplace_fail.pdf']
+        with open(pdf, 'rb') as f:
+            assert f.read() == original
+
+    def test_nothing_drawn_copies_input(self, tmp_path):
+        """With no watermark anywhere, the output is a verbatim copy."""
+        input_pdf = str(tmp_path / 'clean.pdf')
+        output_pdf = str(tmp_path / 'clean_out.pdf')
+        doc = fitz.open()
+        doc.new_page(width=612, height=792).insert_text((50, 100), "No watermark", fontsize=24)
+        doc.save(input_pdf)
+        doc.close()
+
+        result = remove_watermark(input_pdf, output_pdf)
+        assert result['pages_processed'] == 0
+        with open(input_pdf, 'rb') as f_in, open(output_pdf, 'rb') as f_out:
+            assert f_in.read() == f_out.read()
+
+    def test_colour_runs(self):
+        """Columns split into runs wherever the 6-bit colour changes."""
+        row = np.array([[10, 10, 10], [11, 10, 9], [200, 0, 0], [200, 0, 0], [0, 0, 255]],
+                       dtype=np.uint8)
+        # First two columns quantise to the same 6-bit colour
+        assert _colour_runs(row).tolist() == [0, 2, 4, 5]
+
+    def test_colour_runs_flat_within_tolerance(self):
+        """Near-uniform rows stay one run across a quantisation step."""
+        # 127/128 fall either side of a 6-bit quantisation step
+        row = np.array([[127, 127, 127], [128, 128, 128], [127, 128, 129]], dtype=np.uint8)
+        assert _colour_runs(row).tolist() == [0, 3]
+
+    def test_cover_ops_cached_for_identical_pages(self, tmp_path):
+        input_pdf = str(tmp_path / 'cache.pdf')
+        create_test_pdf(input_pdf, pages=2)
+
+        doc = fitz.open(input_pdf)
+        cache = {}
+        first = _cover_ops(doc[0], cache)
+        second = _cover_ops(doc[1], cache)
+        doc.close()
+
+        assert first
+        assert second is first
+        assert len(cache) == 1
+
+    def test_batch_removal(self, tmp_path):
+        pairs = []
+        for n in (1, 3, 2):
+            input_pdf = str(tmp_path / f'batch_{n}.pdf')
+            create_test_pdf(input_pdf, pages=n)
+            pairs.append((input_pdf, str(tmp_path / f'batch_{n}_out.pdf')))
+
+        results = remove_watermark_batch(pairs, workers=2)
+
+        # Results come back in input order
+        assert [r['pages_processed'] for r in results] == [1, 3, 2]
+        assert all(os.path.exists(out) for _, out in pairs)
+
+    def test_watermark_text_redacted(self, tmp_path):
+        """Watermark text should be removed from the PDF, not just painted over."""
+        input_pdf = str(tmp_path / 'text.pdf')
+        output_pdf = str(tmp_path / 'text_out.pdf')
+        doc = fitz.open()
+        page = doc.new_page(width=612, height=792)
+        page.draw_rect(page.rect, color=None, fill=(0.9, 0.9, 0.95))
+        page.insert_text((510, 780), "NotebookLM", fontsize=12)
+        page.insert_text((50, 100), "Body text", fontsize=24)
+        doc.save(input_pdf)
+        doc.close()
+
+        remove_watermark(input_pdf, output_pdf)
+
+        doc = fitz.open(output_pdf)
+        text = doc[0].get_text()
+        # Full-page background is only touched, not covered, so it survives
+        bg = doc[0].get_pixmap(clip=fitz.Rect(0, 0, 10, 10)).pixel(5, 5)
+        doc.close()
+        assert 'NotebookLM' not in text
+        assert 'Body text' in text
+        assert abs(bg[0] - 229) <= 2
+
     def test_nonexistent_input_raises(self, tmp_path):
         with pytest.raises(Exception):
             remove_watermark(str(tmp_path / 'nonexistent.pdf'), str(tmp_path / 'out.pdf'))